@@ -44,6 +44,10 @@ class ImgurBackend(ImageHostingServerBackendInterface):
     ''' The name of the parameter of the uploaded URL. '''
     _IMGUR_RETURNED_URL_PARAM = "link"
 
+    ''' The HTTP status codes of the errors caused by the image itself (bad request, too large, unsupported type), which
+        happen again on each retry. Any other error, e.g. bad credentials, may not happen again once fixed. '''
+    _IMGUR_IMAGE_ERROR_STATUS_CODES = (400, 413, 415)
+
     ''' Ctor '''
     def __init__(self):
         self._imgurClient = None
@@ -65,9 +69,11 @@ class ImgurBackend(ImageHostingServerBackendInterface):
                     returnedImageLink = response[ImgurBackend._IMGUR_RETURNED_URL_PARAM]
             return returnedImageLink
         except ImgurClientRateLimitError as exc:
-            raise imguploader.ImageUploaderException("Rate limit exceeded ({0})!".format(exc))
+            raise imguploader.ImageUploaderTransientException("Rate limit exceeded ({0})!".format(exc))
         except ImgurClientError as exc:
-            raise imguploader.ImageUploaderException("Error occurred while uploading image ({0})!".format(exc))
+            if exc.status_code in ImgurBackend._IMGUR_IMAGE_ERROR_STATUS_CODES:
+                raise imguploader.ImageUploaderPermanentException("Error occurred while uploading image ({0})!".format(exc))
+            raise imguploader.ImageUploaderTransientException("Error occurred while uploading image ({0})!".format(exc))
 
     ''' Set the secret for OAuth '''
     def setSecret(self, secret):
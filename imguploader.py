@@ -15,6 +15,17 @@ from argparse import ArgumentParser
 from importlib import import_module
 import fcntl
 import traceback
+import time
+import glob
+import socket
+import struct
+import io
+import hashlib
+try:
+    import numpy
+except ImportError:
+    ''' NumPy is required only in order to skip near duplicate images, see NearDuplicatesFinder. '''
+    numpy = None
 
 ''' The default logging level is set to  logging.INFO'''
 CONSOLE_DEFAULT_LEVEL = logging.INFO
@@ -30,14 +41,16 @@ def getConsoleLevel(levelString):
 
 ''' UploadedImage represents an image uploaded to the hosting service: it stores the local file name
     of the image, the URL to the full image, and the URL of the thumb image uploaded on the hosting service.
+    It stores as well the perceptual hash of the image (see NearDuplicatesFinder), when it has been computed.
     Note that in principle an entry is not tied to any specific hosting service nor to a specific backend class.
 '''
 class UploadedImage():
 
-    def __init__(self, pFileName, pURLFullImage, pURLThumbImage):
+    def __init__(self, pFileName, pURLFullImage, pURLThumbImage, pPerceptualHash = None):
         self._fileName = pFileName
         self._URLFullImage = pURLFullImage
         self._URLThumbImage = pURLThumbImage
+        self._perceptualHash = pPerceptualHash
 
     def getImageFileName(self):
         return self._fileName
@@ -47,9 +60,31 @@ class UploadedImage():
 
     def getURLThumbImage(self):
         return self._URLThumbImage
+
+    ''' @return The perceptual hash as formatted by NearDuplicatesFinder.formatHash(), None when it is unknown. '''
+    def getPerceptualHash(self):
+        return self._perceptualHash
     
     def __str__(self):
-        return ("[UploadedImage _fileName='%s' _URLFullImage='%s' _URLThumbImage='%s']") % (self._fileName, self._URLFullImage, self._URLThumbImage);
+        return ("[UploadedImage _fileName='%s' _URLFullImage='%s' _URLThumbImage='%s' _perceptualHash='%s']") % (self._fileName, self._URLFullImage, self._URLThumbImage, self._perceptualHash);
+
+''' SkippedImage represents an image that has not been uploaded since it is a near duplicate of another image,
+    the representative one, which has been uploaded in its place.
+'''
+class SkippedImage():
+
+    def __init__(self, pFileName, pRepresentativeFileName):
+        self._fileName = pFileName
+        self._representativeFileName = pRepresentativeFileName
+
+    def getImageFileName(self):
+        return self._fileName
+
+    def getRepresentativeFileName(self):
+        return self._representativeFileName
+
+    def __str__(self):
+        return ("[SkippedImage _fileName='%s' _representativeFileName='%s']") % (self._fileName, self._representativeFileName);
 
 ''' Minimalist exception class for exception casted by the UploadedImagesTracker class.'''
 class UploadedImagesTrackerException(Exception):
@@ -64,6 +99,16 @@ class UploadedImagesTrackerLockAcquiringFailed(Exception):
     -Keeps track of uploaded image in an 'activity log file'; this is mostly done in order to restart the uploading after
      an interruption, saving the time and bandwidth used by the already uploaded images.
     -Grants exclusive access to the same file.
+    -Keeps track of the images skipped as near duplicates of an uploaded one, noting them in the activity log file
+     with an empty URL of the full image followed by the file name of the representative image.
+    -Keeps the perceptual hash of an uploaded image, when known, as a fourth field of its entry, so that it is never
+     computed again.
+
+    When a worker id is provided, the tracker is used by one of several cooperating workers (see ImageClaims): the
+    activity log file is locked in shared mode, and the worker appends its entries to an activity log file of its own
+    (the activity log file name suffixed by the worker id), so that no file is ever written by more than one worker.
+    Entries are read from all the activity log files; the ones of the workers are folded into the activity log file
+    as soon as it is opened in exclusive mode.
 
     This class should be used by using the 'with UploadedImagesTracker() as xxx' pattern.
 '''
@@ -74,15 +119,23 @@ class UploadedImagesTracker():
     ''' Activity log file name. '''
     _ACTIVITYLOG_FILE_NAME = '.imguploader_activity_log_file'
 
-    def __init__(self, pDirectory):
+    def __init__(self, pDirectory, pWorkerId = None):
         self._uploadedImages = []
-        self._activityLogFile = open(os.path.join(pDirectory, self._ACTIVITYLOG_FILE_NAME), 'a+')
+        ''' Uploaded images (UploadedImage) by their file name. '''
+        self._uploadedImagesByFileName = {}
+        ''' Skipped near duplicate images (SkippedImage) by their file name. '''
+        self._skippedImages = {}
+        ''' Read offset of each activity log file of the workers, used to read only what was appended since the last read. '''
+        self._workerLogsOffsets = {}
+        self._activityLogFilePath = os.path.join(pDirectory, self._ACTIVITYLOG_FILE_NAME)
+        self._activityLogFile = open(self._activityLogFilePath, 'a+')
         self._activityLogFile.seek(0, os.SEEK_SET) #Move to the beginning of the file.
         ''' Try to execute a non blocking lock on the activity log file.
             If another instance of this script is already running in the same
-            directory, then the activity log is already locked and the script would exit. '''
+            directory, then the activity log is already locked and the script would exit.
+            Cooperating workers share the lock, which still excludes any instance not cooperating. '''
         try:
-            fcntl.flock(self._activityLogFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(self._activityLogFile, (fcntl.LOCK_EX if pWorkerId is None else fcntl.LOCK_SH) | fcntl.LOCK_NB)
         except IOError:
             raise UploadedImagesTrackerLockAcquiringFailed("Activity log file ({0}) cannot be locked.".format(self._ACTIVITYLOG_FILE_NAME))
 
@@ -91,47 +144,631 @@ class UploadedImagesTracker():
         '''
         content = self._activityLogFile.readlines()
         for textLine in content:
-            textLineTokenized = textLine.strip().split(self._ACTIVITYLOG_TOKEN_SEPARATOR)
-            if(len(textLineTokenized) != 3):
-                raise UploadedImagesTrackerException("Activity log file corrupted ({0}), remove it.".format(self._ACTIVITYLOG_FILE_NAME))
-            self._uploadedImages.append(UploadedImage(textLineTokenized[0], textLineTokenized[1],
-                textLineTokenized[2]))
+            self._addEntry(self._parseEntry(textLine))
+
+        self._workerLogFile = None
+        if pWorkerId is None:
+            self._foldWorkerLogs()
+        else:
+            workerLogPath = self._activityLogFilePath + "." + pWorkerId
+            ''' A crashed worker with the same id (e.g. a reused process id) could have left its last line unfinished:
+                cut it away, otherwise the entries appended after it would make a corrupted line. '''
+            if os.path.exists(workerLogPath):
+                os.truncate(workerLogPath, len(self._readWholeLines(workerLogPath)))
+            self._workerLogFile = open(workerLogPath, 'a+')
+            self.refresh()
 
     def __enter__(self):
         return self
 
     def __exit__(self, pType, pValue, pTraceback):
+        if self._workerLogFile is not None:
+            self._workerLogFile.close()
         self._activityLogFile.close()
 
+    ''' Parse a line of an activity log file into either an UploadedImage or a SkippedImage.
+        @param logFileName The name of the activity log file the line comes from, by default the main one. '''
+    def _parseEntry(self, textLine, logFileName = None):
+        textLineTokenized = textLine.strip().split(self._ACTIVITYLOG_TOKEN_SEPARATOR)
+        ''' An uploaded image may carry its perceptual hash as a fourth field. '''
+        if(len(textLineTokenized) not in (3, 4) or (len(textLineTokenized) == 4 and not textLineTokenized[1])):
+            raise UploadedImagesTrackerException("Activity log file corrupted ({0}), remove it.".format(
+                self._ACTIVITYLOG_FILE_NAME if logFileName is None else logFileName))
+        if not textLineTokenized[1]:
+            return SkippedImage(textLineTokenized[0], textLineTokenized[2])
+        return UploadedImage(textLineTokenized[0], textLineTokenized[1], textLineTokenized[2],
+            textLineTokenized[3] if len(textLineTokenized) == 4 else None)
+
+    ''' Format an UploadedImage or a SkippedImage into a line of the activity log file. '''
+    def _formatEntry(self, entry):
+        if isinstance(entry, SkippedImage):
+            return (entry.getImageFileName()+self._ACTIVITYLOG_TOKEN_SEPARATOR+self._ACTIVITYLOG_TOKEN_SEPARATOR+
+                entry.getRepresentativeFileName()+"\n")
+        textLine = (entry.getImageFileName()+self._ACTIVITYLOG_TOKEN_SEPARATOR+
+            entry.getURLFullImage()+self._ACTIVITYLOG_TOKEN_SEPARATOR+
+            entry.getURLThumbImage())
+        if entry.getPerceptualHash() is not None:
+            textLine += self._ACTIVITYLOG_TOKEN_SEPARATOR+entry.getPerceptualHash()
+        return textLine+"\n"
+
+    ''' @return Whether the entry brings any news: an uploaded image is news unless it has already been uploaded (e.g.
+        by another worker), a skipped image is news unless it has been either uploaded or skipped already. '''
+    def _isNewEntry(self, entry):
+        if isinstance(entry, SkippedImage) and entry.getImageFileName() in self._skippedImages:
+            return False
+        return entry.getImageFileName() not in self._uploadedImagesByFileName
+
+    ''' Store an entry either in the _uploadedImages list or in the _skippedImages dictionary, unless it brings no news.
+        An uploaded image supersedes the same image skipped earlier. Return whether the entry has been stored. '''
+    def _addEntry(self, entry):
+        if not self._isNewEntry(entry):
+            return False
+        if isinstance(entry, SkippedImage):
+            self._skippedImages[entry.getImageFileName()] = entry
+        else:
+            self._skippedImages.pop(entry.getImageFileName(), None)
+            self._uploadedImagesByFileName[entry.getImageFileName()] = entry
+            self._uploadedImages.append(entry)
+        return True
+
+    ''' Write an entry into the activity log file (the one of the worker, when cooperating), then store it. '''
+    def _logEntry(self, entry):
+        logFile = self._activityLogFile if self._workerLogFile is None else self._workerLogFile
+        '''Move file pointer to the end of file.'''
+        logFile.seek(0, 2)
+        logFile.write(self._formatEntry(entry))
+        if self._workerLogFile is not None:
+            ''' Make the entry visible to the other workers, which may run on other hosts, before the claim is released. '''
+            logFile.flush()
+            os.fsync(logFile.fileno())
+            self._workerLogsOffsets[logFile.name] = logFile.tell()
+        self._addEntry(entry)
+
+    ''' @return The paths of the activity log files of the workers. '''
+    def _getWorkerLogPaths(self):
+        return glob.glob(glob.escape(self._activityLogFilePath) + ".*")
+
+    ''' Read the whole lines of an activity log file of a worker from 'offset' on, leaving out the last line when it is
+        unfinished, i.e. still being written or left so by a crashed worker. '''
+    def _readWholeLines(self, workerLogPath, offset = 0):
+        with open(workerLogPath, 'rb') as workerLogFile:
+            workerLogFile.seek(offset, os.SEEK_SET)
+            content = workerLogFile.read()
+        return content[:content.rfind(b"\n") + 1]
+
+    ''' Append to the activity log file the entries of the activity log files of the workers, then remove the latter.
+        The unfinished last line of a crashed worker is dropped: its image is just uploaded again by a later run.
+        This must be called only while holding the exclusive lock. '''
+    def _foldWorkerLogs(self):
+        for workerLogPath in self._getWorkerLogPaths():
+            for textLine in self._readWholeLines(workerLogPath).decode().splitlines():
+                entry = self._parseEntry(textLine, os.path.basename(workerLogPath))
+                if self._isNewEntry(entry):
+                    self._logEntry(entry)
+            self._activityLogFile.flush()
+            os.remove(workerLogPath)
+
+    ''' Read the entries appended to the activity log files of the workers since the last call, e.g. to know
+        which images have been uploaded in the meanwhile by the other workers. '''
+    def refresh(self):
+        for workerLogPath in self._getWorkerLogPaths():
+            offset = self._workerLogsOffsets.get(workerLogPath, 0)
+            try:
+                content = self._readWholeLines(workerLogPath, offset)
+            except IOError:
+                continue #The worker log has been folded in the meanwhile.
+            for textLine in content.decode().splitlines():
+                self._addEntry(self._parseEntry(textLine, os.path.basename(workerLogPath)))
+            self._workerLogsOffsets[workerLogPath] = offset + len(content)
+
     ''' @return Whether the image file has already been uploaded. This is determined by inspecting the activity log file.
     '''
     def isImageAlreadyUploaded(self, imageFileName):
-        found = [i for i, triple in enumerate(self._uploadedImages) if triple.getImageFileName() == imageFileName]
-        return found != []
+        return imageFileName in self._uploadedImagesByFileName
 
     '''
     Add an already uploaded image to the activity log file.
     @param fileName The filename (not including the path) of the image that has been already uploaded.
     '''
-    def addUploadedImage(self, fileName, URLFullImage, URLThumbImage):
-        '''Move file pointer to the end of file.'''
-        self._activityLogFile.seek(0, 2)
-
-        uploadedImage = UploadedImage(fileName, URLFullImage, URLThumbImage)
-        self._activityLogFile.write(uploadedImage.getImageFileName()+self._ACTIVITYLOG_TOKEN_SEPARATOR+
-            uploadedImage.getURLFullImage()+self._ACTIVITYLOG_TOKEN_SEPARATOR+
-            uploadedImage.getURLThumbImage()+"\n")
+    def addUploadedImage(self, fileName, URLFullImage, URLThumbImage, perceptualHash = None):
         ''' Store an entry in the _uploadedImages list that denotes that this image has been successfully uploaded. '''
-        self._uploadedImages.append(uploadedImage)
+        self._logEntry(UploadedImage(fileName, URLFullImage, URLThumbImage, perceptualHash))
+
+    ''' @return The UploadedImage of an uploaded image file, None when it has not been uploaded. '''
+    def getUploadedImage(self, imageFileName):
+        return self._uploadedImagesByFileName.get(imageFileName)
+
+    ''' @return Whether the image file has been skipped as a near duplicate of an uploaded image. '''
+    def isImageSkipped(self, imageFileName):
+        return imageFileName in self._skippedImages
+
+    '''
+    Add to the activity log file an image skipped as a near duplicate of another one.
+    @param fileName The filename (not including the path) of the skipped image.
+    @param representativeFileName The filename of the image uploaded in place of the skipped one.
+    '''
+    def addSkippedImage(self, fileName, representativeFileName):
+        self._logEntry(SkippedImage(fileName, representativeFileName))
 
     def getImageList(self):
         return self._uploadedImages
 
+    def getSkippedImageList(self):
+        return list(self._skippedImages.values())
+
+
+''' FailedImage represents an image whose processing failed: it stores the local file name of the image,
+    the class of the error (either permanent or transient), how many attempts failed so far and the time
+    (in seconds since the epoch) after which the image is eligible for being retried.
+'''
+class FailedImage():
+
+    def __init__(self, pFileName, pErrorClass, pAttemptsCount, pNextEligibleTime):
+        self._fileName = pFileName
+        self._errorClass = pErrorClass
+        self._attemptsCount = pAttemptsCount
+        self._nextEligibleTime = pNextEligibleTime
+
+    def getImageFileName(self):
+        return self._fileName
+
+    def getErrorClass(self):
+        return self._errorClass
+
+    def getAttemptsCount(self):
+        return self._attemptsCount
+
+    def getNextEligibleTime(self):
+        return self._nextEligibleTime
+
+    def __str__(self):
+        return ("[FailedImage _fileName='%s' _errorClass='%s' _attemptsCount=%d _nextEligibleTime=%d]") % (self._fileName, self._errorClass, self._attemptsCount, self._nextEligibleTime);
+
+''' Minimalist exception class for exception casted by the FailedImagesJournal class.'''
+class FailedImagesJournalException(Exception):
+    pass
+
+
+''' Class FailedImagesJournal main duties:
+    -Keeps track of the images whose processing failed in a 'retry journal file' stored next to the activity log file,
+     so that a later run can retry only those images without scanning again the whole directory.
+    -Computes when a failed image is eligible for being retried, backing off exponentially on each failed attempt.
+
+    The retry journal file is not locked on its own: it must be accessed while holding the lock of the
+    UploadedImagesTracker of the same directory. As for the activity log file, a cooperating worker writes to a retry
+    journal file of its own, which is folded into the retry journal file when the latter is opened by a non worker.
+    This class should be used by using the 'with FailedImagesJournal() as xxx' pattern.
+'''
+class FailedImagesJournal():
+
+    ''' Separator character between fields of the retry journal file. '''
+    _JOURNAL_TOKEN_SEPARATOR = "<"
+    ''' Retry journal file name. '''
+    _JOURNAL_FILE_NAME = '.imguploader_retry_journal'
+    ''' Suffix of the name of the temporary file the retry journal file is rewritten into. '''
+    _JOURNAL_TEMPORARY_FILE_SUFFIX = '_tmp'
+    ''' Error class of a failure that retrying cannot fix, e.g. the file is not an image. '''
+    PERMANENT_ERROR = "permanent"
+    ''' Error class of a failure that may not happen again, e.g. a network error or an exceeded rate limit. '''
+    TRANSIENT_ERROR = "transient"
+    ''' Delay in seconds before the first retry; it doubles on each further failed attempt. '''
+    _BACKOFF_BASE_DELAY_SECS = 60
+    ''' Upper bound in seconds of the delay between two retries. '''
+    _BACKOFF_MAX_DELAY_SECS = 24 * 60 * 60
+
+    def __init__(self, pDirectory, pWorkerId = None):
+        self._failedImages = {}
+        journalFilePath = os.path.join(pDirectory, self._JOURNAL_FILE_NAME)
+        ''' The journal is rewritten into a temporary file, which then replaces it: a crash while writing cannot corrupt it.
+            The temporary file name does not match the names of the retry journal files of the workers. '''
+        self._temporaryFilePath = journalFilePath + self._JOURNAL_TEMPORARY_FILE_SUFFIX
+        if pWorkerId is not None:
+            journalFilePath += "." + pWorkerId
+            self._temporaryFilePath += "." + pWorkerId
+        self._journalFilePath = journalFilePath
+
+        '''
+        Recreate (from the retry journal file) the failed images, storing them into self._failedImages.
+        '''
+        if os.path.exists(journalFilePath):
+            with open(journalFilePath, 'r') as journalFile:
+                for failedImage in self._parseJournal(journalFile.readlines()):
+                    self._failedImages[failedImage.getImageFileName()] = failedImage
+
+        if pWorkerId is None:
+            ''' Fold the retry journal files of the workers into this one, keeping the entry with the most attempts. '''
+            workerJournalPaths = glob.glob(glob.escape(journalFilePath) + ".*")
+            for workerJournalPath in workerJournalPaths:
+                with open(workerJournalPath, 'r') as workerJournalFile:
+                    for failedImage in self._parseJournal(workerJournalFile.readlines()):
+                        fileName = failedImage.getImageFileName()
+                        if (fileName not in self._failedImages or
+                            self._failedImages[fileName].getAttemptsCount() < failedImage.getAttemptsCount()):
+                            self._failedImages[fileName] = failedImage
+            if workerJournalPaths:
+                self._writeJournal()
+                for workerJournalPath in workerJournalPaths:
+                    os.remove(workerJournalPath)
+
+    ''' Parse the lines of a retry journal file into a list of FailedImage. '''
+    def _parseJournal(self, content):
+        failedImages = []
+        for textLine in content:
+            textLineTokenized = textLine.strip().split(self._JOURNAL_TOKEN_SEPARATOR)
+            if(len(textLineTokenized) != 4 or
+                textLineTokenized[1] not in (self.PERMANENT_ERROR, self.TRANSIENT_ERROR)):
+                raise FailedImagesJournalException("Retry journal file corrupted ({0}), remove it.".format(self._JOURNAL_FILE_NAME))
+            try:
+                failedImages.append(FailedImage(textLineTokenized[0], textLineTokenized[1],
+                    int(textLineTokenized[2]), int(textLineTokenized[3])))
+            except ValueError:
+                raise FailedImagesJournalException("Retry journal file corrupted ({0}), remove it.".format(self._JOURNAL_FILE_NAME))
+        return failedImages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, pType, pValue, pTraceback):
+        pass #The retry journal file is not kept open, see _writeJournal().
+
+    ''' Rewrite the whole retry journal file with the content of self._failedImages, atomically replacing it. '''
+    def _writeJournal(self):
+        with open(self._temporaryFilePath, 'w') as temporaryFile:
+            for failedImage in self._failedImages.values():
+                temporaryFile.write(failedImage.getImageFileName()+self._JOURNAL_TOKEN_SEPARATOR+
+                    failedImage.getErrorClass()+self._JOURNAL_TOKEN_SEPARATOR+
+                    str(failedImage.getAttemptsCount())+self._JOURNAL_TOKEN_SEPARATOR+
+                    str(failedImage.getNextEligibleTime())+"\n")
+            temporaryFile.flush()
+            os.fsync(temporaryFile.fileno())
+        os.replace(self._temporaryFilePath, self._journalFilePath)
+
+    '''
+    Record a failed attempt of processing an image in the retry journal file.
+    @param fileName The filename (not including the path) of the image whose processing failed.
+    @param errorClass Either PERMANENT_ERROR or TRANSIENT_ERROR.
+    '''
+    def addFailedImage(self, fileName, errorClass):
+        attemptsCount = 1
+        if fileName in self._failedImages:
+            attemptsCount = self._failedImages[fileName].getAttemptsCount() + 1
+        delay = min(self._BACKOFF_BASE_DELAY_SECS * 2 ** (attemptsCount - 1), self._BACKOFF_MAX_DELAY_SECS)
+        self._failedImages[fileName] = FailedImage(fileName, errorClass, attemptsCount, int(time.time()) + delay)
+        self._writeJournal()
+
+    '''
+    Remove an image from the retry journal file, e.g. because it has been eventually uploaded.
+    Nothing is done when the image is not present in the journal.
+    '''
+    def removeFailedImage(self, fileName):
+        if fileName in self._failedImages:
+            del self._failedImages[fileName]
+            self._writeJournal()
+
+    def getFailedImageList(self):
+        return list(self._failedImages.values())
+
+    ''' @return The failed images that are worth retrying now: the ones that failed for a transient error
+        and whose backoff delay has elapsed.
+    '''
+    def getEligibleImageList(self):
+        now = time.time()
+        return [i for i in self._failedImages.values() if i.getErrorClass() == self.TRANSIENT_ERROR and
+            i.getNextEligibleTime() <= now]
+
+
+''' Minimalist exception class for exception casted by the ImageClaims class.'''
+class ImageClaimsException(Exception):
+    pass
+
+
+''' Class ImageClaims main duties:
+    -Lets several workers, even running on different hosts sharing the directory, split the images of the same directory:
+     before processing an image, a worker claims it by creating a 'claim file' in the claims directory.
+    -Lets the images claimed by a crashed worker be claimed again: each claim is a lease which expires after a while.
+
+    A claim file contains the worker id, the state of the claim and the time (in seconds since the epoch) the claim
+    expires at. It is created by means of an exclusive creation, which is atomic on shared file systems as well. An expired
+    claim is taken over by renaming it to a name unique to the worker: only one worker succeeds in renaming it.
+    Note that the hosts are required to have their clocks synchronized, e.g. by means of NTP.
+'''
+class ImageClaims():
+
+    ''' Separator character between fields of the claim file. '''
+    _CLAIM_TOKEN_SEPARATOR = "<"
+    ''' Claims directory name. '''
+    _CLAIMS_DIRECTORY_NAME = '.imguploader_claims'
+    ''' Claim file extension. '''
+    _CLAIM_FILE_EXTENSION = '.claim'
+    ''' State of the claim of an image being processed. '''
+    _ACTIVE_CLAIM = "active"
+    ''' State of the claim of an image whose processing failed: it keeps the other workers from retrying it until it expires. '''
+    _FAILED_CLAIM = "failed"
+    ''' Duration in seconds of a claim, after which a worker is deemed crashed and its claim can be taken over. '''
+    _CLAIM_LEASE_SECS = 30 * 60
+    ''' Name of the claim serializing the generation of the HTML gallery. '''
+    GALLERY_CLAIM_NAME = '.imguploader_gallery'
+    ''' Name of the file storing the stamp of the images contained by the last generated HTML gallery. '''
+    _GALLERY_STAMP_FILE_NAME = '.imguploader_gallery_stamp'
+
+    def __init__(self, pDirectory, pWorkerId):
+        self._workerId = pWorkerId
+        self._claimsDirectory = os.path.join(pDirectory, self._CLAIMS_DIRECTORY_NAME)
+        try:
+            os.makedirs(self._claimsDirectory, exist_ok=True)
+        except OSError as exc:
+            raise ImageClaimsException("Claims directory ({0}) cannot be created: {1}".format(self._CLAIMS_DIRECTORY_NAME, exc))
+
+    def _getClaimFilePath(self, name):
+        return os.path.join(self._claimsDirectory, name + self._CLAIM_FILE_EXTENSION)
+
+    def _formatClaim(self, state, leaseSecs):
+        return (self._workerId+self._CLAIM_TOKEN_SEPARATOR+state+self._CLAIM_TOKEN_SEPARATOR+
+            str(int(time.time()) + leaseSecs)+"\n")
+
+    ''' @return The content of the file (e.g. a claim file), or None when it does not exist. '''
+    def _readFile(self, filePath):
+        try:
+            with open(filePath, 'r') as aFile:
+                return aFile.read()
+        except IOError:
+            return None
+
+    ''' @return The time the claim whose file content is 'content' expires at. A claim not written yet (or garbled)
+        is deemed to expire a lease after the modification time of its file. '''
+    def _getClaimExpiryTime(self, claimFilePath, content):
+        textLineTokenized = content.strip().split(self._CLAIM_TOKEN_SEPARATOR)
+        try:
+            if len(textLineTokenized) == 3:
+                return int(textLineTokenized[2])
+            return os.path.getmtime(claimFilePath) + self._CLAIM_LEASE_SECS
+        except (ValueError, OSError):
+            return 0
+
+    ''' Create the claim file, failing when it already exists. Return whether it has been created. '''
+    def _createClaim(self, claimFilePath):
+        try:
+            fd = os.open(claimFilePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as claimFile:
+            claimFile.write(self._formatClaim(self._ACTIVE_CLAIM, self._CLAIM_LEASE_SECS))
+        return True
+
+    '''
+    Claim an image (or the gallery generation, by means of GALLERY_CLAIM_NAME) for this worker.
+    @param name The filename (not including the path) of the image to be claimed.
+    @return Whether the claim succeeded: if not, the image is being processed by another worker or its processing
+            failed recently.
+    '''
+    def tryClaim(self, name):
+        claimFilePath = self._getClaimFilePath(name)
+        if self._createClaim(claimFilePath):
+            return True
+        content = self._readFile(claimFilePath)
+        if content is None:
+            #The claim has been released in the meanwhile.
+            return self._createClaim(claimFilePath)
+        if self._getClaimExpiryTime(claimFilePath, content) > time.time():
+            return False
+
+        ''' Take over the expired claim. Another worker could have taken it over right before the rename: in that case
+            the renamed claim is not the expired one, and it is restored unless yet another claim has been created. '''
+        takenOverFilePath = claimFilePath + "." + self._workerId
+        try:
+            os.rename(claimFilePath, takenOverFilePath)
+        except FileNotFoundError:
+            return False
+        if self._readFile(takenOverFilePath) != content:
+            try:
+                os.link(takenOverFilePath, claimFilePath)
+            except FileExistsError:
+                pass
+            os.remove(takenOverFilePath)
+            return False
+        os.remove(takenOverFilePath)
+        return self._createClaim(claimFilePath)
+
+    ''' Release the claim of an image whose processing is over. '''
+    def releaseClaim(self, name):
+        try:
+            os.remove(self._getClaimFilePath(name))
+        except FileNotFoundError:
+            pass
+
+    ''' Turn the claim of an image whose processing failed into a failed claim, so that no worker retries it until the
+        lease expires, while not keeping the gallery from being generated. '''
+    def failClaim(self, name):
+        claimFilePath = self._getClaimFilePath(name)
+        temporaryFilePath = claimFilePath + "." + self._workerId
+        with open(temporaryFilePath, 'w') as claimFile:
+            claimFile.write(self._formatClaim(self._FAILED_CLAIM, self._CLAIM_LEASE_SECS))
+        os.replace(temporaryFilePath, claimFilePath)
+
+    ''' @return Whether the processing of an image failed recently, i.e. its claim is an unexpired failed claim. '''
+    def isClaimFailed(self, name):
+        claimFilePath = self._getClaimFilePath(name)
+        content = self._readFile(claimFilePath)
+        if content is None:
+            return False
+        textLineTokenized = content.strip().split(self._CLAIM_TOKEN_SEPARATOR)
+        return (len(textLineTokenized) == 3 and textLineTokenized[1] == self._FAILED_CLAIM and
+            self._getClaimExpiryTime(claimFilePath, content) > time.time())
+
+    ''' @return The stamp stored by setGalleryStamp(), None if no stamp has been stored yet. '''
+    def getGalleryStamp(self):
+        content = self._readFile(os.path.join(self._claimsDirectory, self._GALLERY_STAMP_FILE_NAME))
+        return content.strip() if content is not None else None
+
+    ''' Store a stamp identifying the last generated HTML gallery. It must be called while holding the GALLERY_CLAIM_NAME claim. '''
+    def setGalleryStamp(self, stamp):
+        with open(os.path.join(self._claimsDirectory, self._GALLERY_STAMP_FILE_NAME), 'w') as stampFile:
+            stampFile.write(str(stamp) + "\n")
+
+
+''' Minimalist exception class for exception casted by the NearDuplicatesFinder class.'''
+class NearDuplicatesFinderException(Exception):
+    pass
+
+
+''' Class NearDuplicatesFinder main duties:
+    -Computes a 64 bits perceptual hash of each image out of a tiny grayscale version of it, either by means of
+     the dHash algorithm (signs of the horizontal gradient of a 9x8 version) or of the pHash one (signs of the lowest
+     frequencies of the DCT of a 32x32 version, compared to their median).
+    -Groups the images whose hashes are within a given Hamming distance, e.g. the frames of a burst of shots.
+
+    Hashes are computed and compared in batch by means of NumPy, which is required by this class only.
+'''
+class NearDuplicatesFinder():
+
+    DHASH = "dHash"
+    PHASH = "pHash"
+    ''' Side in bits of the square of bits making the hash. '''
+    _HASH_SIDE = 8
+    ''' Count of bits of a hash, i.e. the maximum Hamming distance between two hashes. '''
+    HASH_BITS = _HASH_SIDE * _HASH_SIDE
+    ''' Side in pixels of the grayscale version of the image the pHash is computed out of. '''
+    _PHASH_SAMPLE_SIDE = 32
+    ''' Count of hashes compared at once against all the others, to bound the memory used by the comparison. '''
+    _COMPARISON_BLOCK_ROWS = 256
+
+    def __init__(self, pAlgorithm, pMaxDistance):
+        if numpy is None:
+            raise NearDuplicatesFinderException("NumPy is required in order to find near duplicate images.")
+        if pAlgorithm not in (self.DHASH, self.PHASH):
+            raise NearDuplicatesFinderException("Unknown perceptual hash algorithm \"{0}\".".format(pAlgorithm))
+        self._algorithm = pAlgorithm
+        self._maxDistance = pMaxDistance
+
+    ''' @return The (width, height) in pixels of the grayscale version of an image the hash is computed out of. '''
+    def _getSampleSize(self):
+        if self._algorithm == self.DHASH:
+            return (self._HASH_SIDE + 1, self._HASH_SIDE)
+        return (self._PHASH_SAMPLE_SIDE, self._PHASH_SAMPLE_SIDE)
+
+    ''' Load the image file as a grayscale image scaled down to 'size'. Since a JPEG image is decoded directly at
+        a reduced scale (see Image.draft()), this is way cheaper than decoding it at full size. '''
+    def _loadSample(self, imageFilePath, size):
+        image = Image.open(imageFilePath)
+        image.draft("L", size)
+        return numpy.asarray(image.convert("L").resize(size, Image.ANTIALIAS), dtype=numpy.float32)
+
+    '''
+    Compute the perceptual hash of the provided images.
+    @param imageFilePaths The list of paths to the image files.
+    @return A tuple with the array of the hashes, one row of 8 bytes per image, and the list of the indices in
+            'imageFilePaths' of the hashed images, i.e. of the ones which have been successfully loaded.
+    '''
+    def computeHashes(self, imageFilePaths):
+        sampleSize = self._getSampleSize()
+        samples = []
+        hashedIndices = []
+        for index, imageFilePath in enumerate(imageFilePaths):
+            try:
+                samples.append(self._loadSample(imageFilePath, sampleSize))
+                hashedIndices.append(index)
+            except IOError:
+                pass #Files that cannot be decoded are not hashed, their upload would fail anyway.
+        if not samples:
+            return (numpy.zeros((0, self._HASH_SIDE * self._HASH_SIDE // 8), dtype=numpy.uint8), hashedIndices)
+        samples = numpy.stack(samples)
+
+        if self._algorithm == self.DHASH:
+            bits = samples[:, :, 1:] > samples[:, :, :-1]
+        else:
+            side = self._PHASH_SAMPLE_SIDE
+            ''' Orthogonal DCT-II matrix, applied to both the rows and the columns of all the samples at once. '''
+            frequencies = numpy.arange(side).reshape(-1, 1)
+            dct = numpy.cos(numpy.pi * frequencies * (2 * numpy.arange(side) + 1) / (2.0 * side)) * numpy.sqrt(2.0 / side)
+            dct[0, :] /= numpy.sqrt(2.0)
+            lowFrequencies = (dct @ samples @ dct.T)[:, :self._HASH_SIDE, :self._HASH_SIDE].reshape(len(samples), -1)
+            ''' The DC term is left out of the median, as it just carries the average brightness. '''
+            medians = numpy.median(lowFrequencies[:, 1:], axis=1)
+            bits = lowFrequencies > medians[:, numpy.newaxis]
+        return (numpy.packbits(bits.reshape(len(samples), -1), axis=1), hashedIndices)
+
+    '''
+    Group the hashes within the maximum Hamming distance. Hashes are scanned in order: each hash not grouped yet
+    starts a new group, along with all the following hashes not grouped yet which are close enough to it. Unlike
+    grouping transitively, this keeps a slowly changing sequence of shots from collapsing into a single group.
+    @param hashes The array of the hashes as returned by computeHashes().
+    @return A list of groups, each one being the list of the indices of its hashes, the first one leading it.
+    '''
+    def groupHashes(self, hashes):
+        popCounts = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+        grouped = numpy.zeros(len(hashes), dtype=bool)
+        groups = []
+        for blockStart in range(0, len(hashes), self._COMPARISON_BLOCK_ROWS):
+            block = hashes[blockStart:blockStart + self._COMPARISON_BLOCK_ROWS]
+            ''' Hamming distances between the hashes of the block and all the hashes, by counting the differing bits. '''
+            distances = popCounts[block[:, numpy.newaxis, :] ^ hashes[numpy.newaxis, :, :]].sum(axis=2, dtype=numpy.uint32)
+            for row in range(len(block)):
+                if grouped[blockStart + row]:
+                    continue
+                members = numpy.flatnonzero((distances[row] <= self._maxDistance) & ~grouped)
+                grouped[members] = True
+                groups.append(members.tolist())
+        return groups
+
+    ''' @return The hash (a row returned by computeHashes()) as a string, tagged with the algorithm it is computed by. '''
+    def formatHash(self, hashRow):
+        return self._algorithm + ":" + hashRow.tobytes().hex()
+
+    ''' @return The hash formatted by formatHash() as a row like the ones returned by computeHashes(), None when it has
+        been computed by another algorithm or it is garbled. '''
+    def parseHash(self, hashString):
+        algorithm, _, hexDigits = hashString.partition(":")
+        try:
+            hashBytes = bytes.fromhex(hexDigits)
+        except ValueError:
+            return None
+        if algorithm != self._algorithm or len(hashBytes) != self.HASH_BITS // 8:
+            return None
+        return numpy.frombuffer(hashBytes, dtype=numpy.uint8)
+
+    '''
+    Group the near duplicate images among the provided ones.
+    @param imageFilePaths The list of paths to the image files, e.g. sorted by name so that shots are in sequence.
+    @param hashes A dictionary of the hashes (as formatted by formatHash()) known in advance, by index in 'imageFilePaths':
+           only the images whose hash is not known are hashed, and their hashes are added to the dictionary.
+    @return A list of groups, each one being the list of the indices in 'imageFilePaths' of its images, the first
+            one leading it. Every image belongs to a group, possibly made of that image only.
+    '''
+    def findNearDuplicates(self, imageFilePaths, hashes = None):
+        if hashes is None:
+            hashes = {}
+        knownHashes = {}
+        for index, hashString in hashes.items():
+            hashRow = self.parseHash(hashString)
+            if hashRow is not None:
+                knownHashes[index] = hashRow
+        missingIndices = [i for i in range(len(imageFilePaths)) if i not in knownHashes]
+        computedHashes, hashedIndices = self.computeHashes([imageFilePaths[i] for i in missingIndices])
+        for hashRow, index in zip(computedHashes, hashedIndices):
+            knownHashes[missingIndices[index]] = hashRow
+            hashes[missingIndices[index]] = self.formatHash(hashRow)
+
+        hashedIndices = sorted(knownHashes)
+        groups = []
+        if hashedIndices:
+            allHashes = numpy.stack([knownHashes[i] for i in hashedIndices])
+            groups = [[hashedIndices[i] for i in group] for group in self.groupHashes(allHashes)]
+        notHashed = set(range(len(imageFilePaths))) - set(hashedIndices)
+        return sorted(groups + [[i] for i in notHashed])
+
 
 ''' Minimalist exception class for the exceptions casted by the ImageUploader class.'''
 class ImageUploaderException(Exception):
     pass
 
+''' Failure that would happen again on each retry, e.g. the file is not an image. '''
+class ImageUploaderPermanentException(ImageUploaderException):
+    pass
+
+''' Failure that may not happen again on a later retry, e.g. a network error or an exceeded rate limit. '''
+class ImageUploaderTransientException(ImageUploaderException):
+    pass
+
 
 
 
@@ -178,6 +815,12 @@ class ImageUploader:
     _CFG_OAUTH_CLIENT_ID = "oauthClientId"
     _CFG_OAUTH_SECRET = "oauthSecret"
     _CFG_BACKEND_CLASS = "hostingServerBackendClass"
+    _CFG_NEAR_DUPLICATES_MAX_DISTANCE = "nearDuplicatesMaxDistance"
+    _CFG_PERCEPTUAL_HASH_ALGORITHM = "perceptualHashAlgorithm"
+    ''' Maximum relative difference between the aspect ratio of an embedded preview and the one of the primary image. '''
+    _PREVIEW_ASPECT_RATIO_TOLERANCE = 0.02
+    ''' Delay in seconds between two checks of the claims held by the other cooperative workers. '''
+    _CLAIMS_POLLING_SECS = 15
 
     ''' Initialize the instance by reading settings from the configuration file
         and using fallback values when the configuration file is not available or incomplete'''
@@ -194,6 +837,12 @@ class ImageUploader:
         self._oauthClientId = None
         self._oauthSecret = None
         self._backendClass = None
+        ''' _nearDuplicatesMaxDistance is either set to None (near duplicates are uploaded), either set to the maximum
+            Hamming distance between the perceptual hashes of two near duplicate images.'''
+        self._nearDuplicatesMaxDistance = None
+        self._perceptualHashAlgorithm = NearDuplicatesFinder.DHASH
+        ''' Perceptual hashes of the images to be uploaded by file name, noted along with the upload of each image. '''
+        self._perceptualHashes = {}
 
         self._loggingInit(logLevel)
         ''' Read, parse and validate the configuration file '''
@@ -338,6 +987,19 @@ class ImageUploader:
 
         self._htmlFooterFilePath = self._getOptionalValue(sectionDict, ImageUploader._CFG_HTML_FOOTER_FILE_PATH, "")
 
+        maxDistance = self._getOptionalValue(sectionDict, ImageUploader._CFG_NEAR_DUPLICATES_MAX_DISTANCE, "")
+        if maxDistance:
+            self._nearDuplicatesMaxDistance = self._raiseErrorWhetherNotAnInt(maxDistance, ImageUploader._CFG_NEAR_DUPLICATES_MAX_DISTANCE)
+            if not 0 <= self._nearDuplicatesMaxDistance <= NearDuplicatesFinder.HASH_BITS:
+                raise ImageUploaderException("The provided value \"{1}\" for option \"{0}\" must be between 0 and {2}.".format(
+                    ImageUploader._CFG_NEAR_DUPLICATES_MAX_DISTANCE, maxDistance, NearDuplicatesFinder.HASH_BITS))
+            if numpy is None:
+                raise ImageUploaderException("{0} requires NumPy, which is not installed.".format(ImageUploader._CFG_NEAR_DUPLICATES_MAX_DISTANCE))
+        self._perceptualHashAlgorithm = self._getOptionalValue(sectionDict, ImageUploader._CFG_PERCEPTUAL_HASH_ALGORITHM, NearDuplicatesFinder.DHASH)
+        if self._perceptualHashAlgorithm not in (NearDuplicatesFinder.DHASH, NearDuplicatesFinder.PHASH):
+            raise ImageUploaderException("Invalid value \"{1}\" for {0}, it must be either {2} or {3}.".format(ImageUploader._CFG_PERCEPTUAL_HASH_ALGORITHM,
+                self._perceptualHashAlgorithm, NearDuplicatesFinder.DHASH, NearDuplicatesFinder.PHASH))
+
     def getImageSourceDirectory(self):
         return self._sourceImageDirectory
 
@@ -379,39 +1041,191 @@ class ImageUploader:
             fileToLoad.close()
         return fileContent
 
+    ''' Return the value of the EXIF Orientation tag of 'image', or None when the image does not carry it. '''
+    def _getExifOrientation(self, image):
+        for orientation in ExifTags.TAGS.keys() :
+            if ExifTags.TAGS[orientation]=='Orientation' : break
+        lExif = image._getexif()
+        if(lExif):
+            exif=dict(lExif.items())
+            if orientation in exif:
+                return exif[orientation]
+        return None
+
+    ''' Rotate 'image' according to the provided EXIF 'orientation' value, return the rotated image. '''
+    def _applyExifOrientation(self, image, orientation):
+        if orientation == 3 :
+            image=image.rotate(180, expand=True)
+        elif orientation == 6 :
+            image=image.rotate(270, expand=True)
+        elif orientation == 8 :
+            image=image.rotate(90, expand=True)
+        return image
+
+    ''' Extract the JPEG thumbnail stored in the IFD1 directory of the raw EXIF block 'exifData'
+        (as found under the 'exif' key of the info dictionary of a JPEG image).
+        @return The bytes of the embedded JPEG thumbnail, or None when it is missing or the EXIF block is malformed.
+    '''
+    def _getExifThumbnailData(self, exifData):
+        if not isinstance(exifData, bytes) or not exifData.startswith(b"Exif\x00\x00"):
+            return None
+        tiff = exifData[6:]
+        if tiff[:2] == b"II":
+            endian = "<"
+        elif tiff[:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+        thumbOffset = None
+        thumbLength = None
+        try:
+            ifd0Offset = struct.unpack_from(endian + "L", tiff, 4)[0]
+            entriesCount = struct.unpack_from(endian + "H", tiff, ifd0Offset)[0]
+            ifd1Offset = struct.unpack_from(endian + "L", tiff, ifd0Offset + 2 + 12 * entriesCount)[0]
+            if ifd1Offset == 0:
+                return None
+            entriesCount = struct.unpack_from(endian + "H", tiff, ifd1Offset)[0]
+            for i in range(entriesCount):
+                entryOffset = ifd1Offset + 2 + 12 * i
+                tag, fieldType = struct.unpack_from(endian + "HH", tiff, entryOffset)
+                #A SHORT value is left justified into the 4 bytes value field.
+                value = struct.unpack_from(endian + ("H" if fieldType == 3 else "L"), tiff, entryOffset + 8)[0]
+                if tag == 0x0201: #JPEGInterchangeFormat
+                    thumbOffset = value
+                elif tag == 0x0202: #JPEGInterchangeFormatLength
+                    thumbLength = value
+        except struct.error:
+            return None
+        if thumbOffset is None or not thumbLength or thumbOffset + thumbLength > len(tiff):
+            return None
+        return tiff[thumbOffset:thumbOffset + thumbLength]
+
+    ''' Walk the JPEG markers of 'imageFile' looking for the APP2 segment of the Multi-Picture Format (MPF).
+        @return The file offset the MPF data offsets are relative to, or None when the segment is not found.
+    '''
+    def _getMPFOffset(self, imageFile):
+        imageFile.seek(0)
+        if imageFile.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = imageFile.read(4)
+            #Stop at the start of the scan data, the MPF segment must precede it.
+            if len(marker) < 4 or marker[0] != 0xFF or marker[1] == 0xDA:
+                return None
+            segmentLength = struct.unpack(">H", marker[2:])[0]
+            if marker[1] == 0xE2:
+                if imageFile.read(4) == b"MPF\x00":
+                    return imageFile.tell()
+                imageFile.seek(segmentLength - 6, os.SEEK_CUR)
+            else:
+                imageFile.seek(segmentLength - 2, os.SEEK_CUR)
+
+    ''' Read the JPEG previews listed in the Multi-Picture Format (MPF) index of 'image', primary image excluded.
+        @return A list with the bytes of each preview, empty when the image has no MPF index.
+    '''
+    def _getMPFPreviewsData(self, image, imageFilePath):
+        previews = []
+        try:
+            mpInfo = image._getmp()
+        except Exception:
+            return previews
+        if not isinstance(mpInfo, dict) or 0xB002 not in mpInfo:
+            return previews
+        with open(imageFilePath, 'rb') as imageFile:
+            mpOffset = self._getMPFOffset(imageFile)
+            if mpOffset is None:
+                return previews
+            for entry in mpInfo[0xB002]:
+                #Only the large thumbnails are previews: other entries are further full size frames, e.g. of a stereo pair.
+                if entry["DataOffset"] == 0 or not str(entry["Attribute"]["MPType"]).startswith("Large Thumbnail"):
+                    continue
+                imageFile.seek(mpOffset + entry["DataOffset"])
+                previews.append(imageFile.read(entry["Size"]))
+        return previews
+
+    ''' Look for a preview embedded into the JPEG 'image' (either the EXIF thumbnail or an MPF preview) which
+        is wide enough to be resized to 'imageSize' and has the same aspect ratio of the primary image.
+        @param orientation The EXIF orientation of the primary image, which applies to the previews as well.
+        @return The largest of such previews as an already decoded Image object, or None when there is no suitable
+                preview. A preview that fails to decode (e.g. it is truncated) is passed over in favour of the next one.
+    '''
+    def _findEmbeddedPreview(self, image, imageFilePath, imageSize, orientation):
+        if image.format not in ("JPEG", "MPO"):
+            return None
+        candidates = self._getMPFPreviewsData(image, imageFilePath)
+        candidates.append(self._getExifThumbnailData(image.info.get("exif")))
+        primaryRatio = image.size[0] / float(image.size[1])
+        suitablePreviews = []
+        for previewData in candidates:
+            if not previewData or not previewData.startswith(b"\xff\xd8"):
+                continue
+            try:
+                #Only the header is parsed here: only the selected preview gets decoded.
+                preview = Image.open(io.BytesIO(previewData))
+            except IOError:
+                continue
+            width, height = preview.size
+            #Skip letterboxed previews, such as the 4:3 EXIF thumbnails of 3:2 images.
+            if abs(width / float(height) - primaryRatio) > primaryRatio * self._PREVIEW_ASPECT_RATIO_TOLERANCE:
+                continue
+            if orientation in (6, 8):
+                width, height = height, width
+            if width < imageSize[0]:
+                continue
+            suitablePreviews.append(preview)
+        for preview in sorted(suitablePreviews, key=lambda p: p.size[0], reverse=True):
+            try:
+                preview.load()
+                return preview
+            except (IOError, SyntaxError):
+                self._getLog().debug(("skipping the corrupted embedded preview {0} of {1}").format(preview.size, imageFilePath))
+        return None
+
+    ''' Open the image file and rotate it according to its EXIF orientation.
+        @param useEmbeddedPreview When True, a preview embedded into the file replaces the primary image
+               whenever it is large enough for 'imageSize', sparing the decoding of the full frame.
+        @remark Raises an ImageUploaderPermanentException exception if 'imageFilePath' is not a recognized image format.
+    '''
+    def _openOrientedImage(self, imageFilePath, imageSize, useEmbeddedPreview):
+        self._getLog().debug(("opening {0}").format(imageFilePath))
+        try:
+            image = Image.open(imageFilePath)
+            orientation = self._getExifOrientation(image)
+            if useEmbeddedPreview:
+                preview = self._findEmbeddedPreview(image, imageFilePath, imageSize, orientation)
+                if preview is not None:
+                    self._getLog().debug(("using the embedded preview {0} of {1}").format(preview.size, imageFilePath))
+                    image = preview
+            image = self._applyExifOrientation(image, orientation)
+            #Decode the image now, since Pillow decodes it only when it is first used (e.g. a truncated file fails here).
+            image.load()
+            return image
+        except (IOError, SyntaxError) as exc:
+            raise ImageUploaderPermanentException("{0} is not a valid image file: {1}".format(imageFilePath, exc))
+
     ''' Resize the image according to the provided size, then uploads it on the
         remote image hosting site. Returns the direct link to the resized image.
         @param imageFilePath The absolute path to the image file.
         @param imageSize A tuple containing (width, height) in pixels.
+        @param useEmbeddedPreview Whether a large enough preview embedded into the image file may be used as source.
         @return None when the provided image has an unknown image format.
         @remark Raises an ImageUploaderException exception in the following cases:
-                -if the provided 'imageFilePath' is not a recognized image format. 
-                -whenever the backend class throws an exception'''
-    def _remoteImageCreate(self, imageFilePath, imageSize):
-        self._getLog().debug(("opening {0}").format(imageFilePath))
-        image = None
-        try:
-            image = Image.open(imageFilePath)
-            for orientation in ExifTags.TAGS.keys() :
-                if ExifTags.TAGS[orientation]=='Orientation' : break
-            lExif = image._getexif()
-            if(lExif):
-                exif=dict(lExif.items())
-                if orientation in exif:
-                    if exif[orientation] == 3 :
-                        image=image.rotate(180, expand=True)
-                    elif exif[orientation] == 6 :
-                        image=image.rotate(270, expand=True)
-                    elif exif[orientation] == 8 :
-                        image=image.rotate(90, expand=True)
-        except IOError:
-            raise ImageUploaderException("{0} is not an image file.".format(imageFilePath))
+                -if the provided 'imageFilePath' is not a recognized image format, or it cannot be decoded (ImageUploaderPermanentException).
+                -if the resized image cannot be saved into the temporary directory (ImageUploaderTransientException).
+                -whenever the backend class throws an exception (ImageUploaderTransientException unless the backend
+                 raised a more specific ImageUploaderException).'''
+    def _remoteImageCreate(self, imageFilePath, imageSize, useEmbeddedPreview = False):
+        image = self._openOrientedImage(imageFilePath, imageSize, useEmbeddedPreview)
 
         self._getLog().debug(("resizing... {0}").format(imageFilePath))
         image = image.resize((imageSize[0],
             int(image.size[1] / (image.size[0] / float(imageSize[0])))), Image.ANTIALIAS)
-        saveFilePath = os.path.join(self._tmpDirectory, imageFilePath)
-        image.save(saveFilePath)
+        saveFilePath = os.path.join(self._tmpDirectory, os.path.basename(imageFilePath))
+        try:
+            image.save(saveFilePath)
+        except IOError as exc:
+            #E.g. the temporary directory is full: the image may be saved on a later retry.
+            raise ImageUploaderTransientException("The resized image cannot be saved into {0}: {1}".format(saveFilePath, exc))
         self._getLog().debug(("saved {0} !").format(imageFilePath))
         self._getLog().debug(("uploading {0} with size {1}.").format(imageFilePath, imageSize))
 
@@ -421,8 +1235,11 @@ class ImageUploader:
             hostingServerInterface.setClientId(self._oauthClientId)
             hostingServerInterface.setSecret(self._oauthSecret)
             return hostingServerInterface.uploadImage(saveFilePath)
+        except ImageUploaderException:
+            raise
         except Exception as pExc:
-            raise ImageUploaderException("Unexpected error occurred during backend execution: '{0}'".format(pExc))
+            #Anything not classified by the backend (e.g. a connection aborted) is deemed worth a retry.
+            raise ImageUploaderTransientException("Unexpected error occurred during backend execution: '{0}'".format(pExc))
         
     ''' Given the URL link to the thumb and to the actual image, it returns an HTML
         code that displays the thumb and open in a new tab the actual image when the thumb is clicked.'''
@@ -431,9 +1248,9 @@ class ImageUploader:
         return image_link_template.format(imageLink, thumbLink)
 
         '''
-            Create in the _sourceImageDirectory directory the HTML file
+            Create in the _sourceImageDirectory directory the HTML file with the images noted in the provided tracker.
             '''
-    def _generateHTMLFile(self):
+    def _generateHTMLFile(self, pUploadedImagesTracker):
         self._renameExistingFile(self._outputHTMLFilename)
         headerString = ""
         try:
@@ -448,7 +1265,7 @@ class ImageUploader:
 
         with open(os.path.join(os.curdir, self._outputHTMLFilename), "wb") as outputFile:
             outputFile.write(bytes(headerString, 'UTF-8'))
-            for i in lImageTracker.getImageList():
+            for i in pUploadedImagesTracker.getImageList():
                 outputFile.write(bytes(self._createImageLink(i.getURLFullImage(), i.getURLThumbImage()), 'UTF-8'))
                 outputFile.write(bytes("&nbsp;", 'UTF-8'))
             outputFile.write(bytes(footerString, 'UTF-8'))
@@ -470,43 +1287,202 @@ class ImageUploader:
                 del lImage #Clean up any acquired resources.
         return lImageFiles
     
+    ''' Upload the full and the thumb images of a single file, noting it into the activity log file on success.
+        On failure, the file is recorded into the retry journal (when one is provided) along with the class of the error.
+        @return None when the file has been uploaded, either now or by an earlier run, otherwise the class of the
+                error, i.e. either FailedImagesJournal.PERMANENT_ERROR or FailedImagesJournal.TRANSIENT_ERROR.
+    '''
+    def _uploadImage(self, imageFileName, pUploadedImagesTracker, pFailedImagesJournal):
+        try:
+            '''
+            Skip any file already processed (i.e. already present into the lock file).
+            '''
+            if(pUploadedImagesTracker.isImageAlreadyUploaded(imageFileName)):
+                self._getLog().info("Skipped already uploaded file {0}.".format(str(imageFileName)))
+            else:
+                self._getLog().info("Processing file {0} ...".format(str(imageFileName)))
+                lImageFullPath = os.path.join(self._sourceImageDirectory, imageFileName)
+                URLFullImage = self._remoteImageCreate(lImageFullPath, self._targetImageSize)
+                self._getLog().info("uploaded full image for {0}".format(str(imageFileName)))
+                URLThumbImage = self._remoteImageCreate(lImageFullPath, self._thumbImageSize, True)
+                self._getLog().info("uploaded thumb image for {0}.".format(str(imageFileName)))
+                pUploadedImagesTracker.addUploadedImage(imageFileName, URLFullImage, URLThumbImage,
+                    self._perceptualHashes.get(imageFileName))
+            if pFailedImagesJournal is not None:
+                pFailedImagesJournal.removeFailedImage(imageFileName)
+            return None
+        except ImageUploaderException as e:
+            self._getLog().warning("skipping file {0} for error: {1}".format(str(imageFileName), str(e)))
+            if isinstance(e, ImageUploaderPermanentException):
+                errorClass = FailedImagesJournal.PERMANENT_ERROR
+            else:
+                errorClass = FailedImagesJournal.TRANSIENT_ERROR
+            if pFailedImagesJournal is not None:
+                pFailedImagesJournal.addFailedImage(imageFileName, errorClass)
+            return errorClass
+
+    ''' Group the images to be uploaded that are near duplicates of each other, when enabled by the configuration file.
+        Images already uploaded lead the groups of their near duplicates, so that the shots of a burst are not uploaded
+        again by a later run, while images already skipped as near duplicates are left out.
+        @return A list of groups, each one being a list of image file names: the first one of each group is the
+                one to be uploaded, the others are its near duplicates.
+    '''
+    def _groupNearDuplicates(self, pImages, pUploadedImagesTracker):
+        if self._nearDuplicatesMaxDistance is None:
+            return [[imageFileName] for imageFileName in pImages]
+
+        lImages = []
+        for imageFileName in pImages:
+            if pUploadedImagesTracker.isImageSkipped(imageFileName):
+                self._getLog().info("Skipped already skipped near duplicate file {0}.".format(imageFileName))
+            else:
+                lImages.append(imageFileName)
+        ''' Sort the images by name, so that the shots of a burst are in sequence, after the uploaded ones. '''
+        lUploaded = sorted(imageFileName for imageFileName in lImages if pUploadedImagesTracker.isImageAlreadyUploaded(imageFileName))
+        lCandidates = sorted(imageFileName for imageFileName in lImages if not pUploadedImagesTracker.isImageAlreadyUploaded(imageFileName))
+        if not lCandidates:
+            return [[imageFileName] for imageFileName in lUploaded]
+        lImages = lUploaded + lCandidates
+        self._getLog().info("Looking for near duplicates among {0} files...".format(len(lImages)))
+        lFinder = NearDuplicatesFinder(self._perceptualHashAlgorithm, self._nearDuplicatesMaxDistance)
+        ''' The hashes of the uploaded images are read from the activity log file, computing only the missing ones. '''
+        lHashes = {}
+        for index, imageFileName in enumerate(lUploaded):
+            lPerceptualHash = pUploadedImagesTracker.getUploadedImage(imageFileName).getPerceptualHash()
+            if lPerceptualHash is not None:
+                lHashes[index] = lPerceptualHash
+        lGroups = []
+        lFoundGroups = lFinder.findNearDuplicates([os.path.join(self._sourceImageDirectory, f) for f in lImages], lHashes)
+        self._perceptualHashes = {lImages[i]: lHashes[i] for i in lHashes if i >= len(lUploaded)}
+        for lGroup in lFoundGroups:
+            ''' Uploaded images come first, so a group is led by an uploaded image whenever it holds any: the other
+                uploaded images of the group are kept on their own, as they must not be recorded as skipped. '''
+            lGroups.append([lImages[lGroup[0]]] + [lImages[i] for i in lGroup[1:] if i >= len(lUploaded)])
+            lGroups.extend([lImages[i]] for i in lGroup[1:] if i < len(lUploaded))
+        return lGroups
+
     ''' Iterates over all files in the configured path and upload
         all the files that represent a recognized image format. Then it creates an HTML file
         containing a gallery of the uploaded images.
+        When enabled by the configuration file, only one image out of each group of near duplicates is uploaded.
+        @param pFailedImagesJournal The FailedImagesJournal where failures are recorded, None to not record them.
     '''
-    def uploadImagesAndCreateHTMLGallery(self, pUploadedImagesTracker):
+    def uploadImagesAndCreateHTMLGallery(self, pUploadedImagesTracker, pFailedImagesJournal = None):
         try:
             lImages = ImageUploader.getImagesList(self._sourceImageDirectory)
-            for imageFileName in lImages:
-                try:
-                    '''
-                    Skip any file already processed (i.e. already present into the lock file).
-                    '''
-                    if(pUploadedImagesTracker.isImageAlreadyUploaded(imageFileName)):
-                        self._getLog().info("Skipped already uploaded file {0}.".format(str(imageFileName)))
-                    else:
-                        self._getLog().info("Processing file {0} ...".format(str(imageFileName)))
-                        lImageFullPath = os.path.join(self._sourceImageDirectory, imageFileName)
-                        URLFullImage = self._remoteImageCreate(lImageFullPath, self._targetImageSize)
-                        self._getLog().info("uploaded full image for {0}".format(str(imageFileName)))
-                        URLThumbImage = self._remoteImageCreate(lImageFullPath, self._thumbImageSize)
-                        self._getLog().info("uploaded thumb image for {0}.".format(str(imageFileName)))
-                        pUploadedImagesTracker.addUploadedImage(imageFileName, URLFullImage, URLThumbImage)
-                except ImageUploaderException as e:
-                    self._getLog().warning("skipping file {0} for error: {1}".format(str(imageFileName), str(e)))
-
-            self._generateHTMLFile()
+            for lGroup in self._groupNearDuplicates(lImages, pUploadedImagesTracker):
+                ''' Upload the first image of the group that can be uploaded, and skip the others as its near duplicates.
+                    The next image is tried only when the upload failed for good: after a transient error the whole group
+                    is left to a later run, which would otherwise upload the failed image along with its near duplicate. '''
+                for index, imageFileName in enumerate(lGroup):
+                    lErrorClass = self._uploadImage(imageFileName, pUploadedImagesTracker, pFailedImagesJournal)
+                    if lErrorClass is None:
+                        for lDuplicateFileName in lGroup[index + 1:]:
+                            self._getLog().info("Skipped file {0} as near duplicate of {1}.".format(lDuplicateFileName, imageFileName))
+                            pUploadedImagesTracker.addSkippedImage(lDuplicateFileName, imageFileName)
+                        break
+                    if lErrorClass != FailedImagesJournal.PERMANENT_ERROR:
+                        if index + 1 < len(lGroup):
+                            self._getLog().info("Left the near duplicates of file {0} to a later run.".format(imageFileName))
+                        break
+
+            self._generateHTMLFile(pUploadedImagesTracker)
                     
         except UploadedImagesTrackerException as e:
             #//## TODO HACK The exception below should be casted upon some value coming from the exception catched.
             # Here instead it is just casted, whatever the catched exception is.
             raise ImageUploaderException("Another instance of the script is running in the same directory \"{0}\"".format(self._sourceImageDirectory))
 
+    ''' Retry only the files recorded into the retry journal that failed for a transient error and whose
+        backoff delay has elapsed, without scanning the configured path. Then it creates an HTML file
+        containing a gallery of the uploaded images.
+    '''
+    def retryFailedImagesAndCreateHTMLGallery(self, pUploadedImagesTracker, pFailedImagesJournal):
+        lFailedImages = pFailedImagesJournal.getFailedImageList()
+        lEligibleImages = pFailedImagesJournal.getEligibleImageList()
+        self._getLog().info("Retrying {0} of {1} failed files.".format(len(lEligibleImages), len(lFailedImages)))
+        for failedImage in lFailedImages:
+            if failedImage not in lEligibleImages:
+                self._getLog().info("Not retrying file {0} failed for a {1} error after {2} attempt(s).".format(
+                    failedImage.getImageFileName(), failedImage.getErrorClass(), failedImage.getAttemptsCount()))
+        for failedImage in lEligibleImages:
+            imageFileName = failedImage.getImageFileName()
+            if not os.path.isfile(os.path.join(self._sourceImageDirectory, imageFileName)):
+                self._getLog().warning("Forgetting file {0} as it does not exist anymore.".format(imageFileName))
+                pFailedImagesJournal.removeFailedImage(imageFileName)
+            else:
+                self._uploadImage(imageFileName, pUploadedImagesTracker, pFailedImagesJournal)
+
+        self._generateHTMLFile(pUploadedImagesTracker)
+
+    ''' @return Whether no work is left on the image file: either it has been uploaded, or it has been skipped as a near
+        duplicate (skip entries are honoured only while near duplicates are looked for). '''
+    def _isImageDone(self, imageFileName, pUploadedImagesTracker):
+        return (pUploadedImagesTracker.isImageAlreadyUploaded(imageFileName) or
+            (self._nearDuplicatesMaxDistance is not None and pUploadedImagesTracker.isImageSkipped(imageFileName)))
+
+    ''' @return A digest of the names of the uploaded images, identifying the content of the HTML gallery. '''
+    def _getImagesStamp(pUploadedImagesTracker):
+        lNames = sorted(img.getImageFileName() for img in pUploadedImagesTracker.getImageList())
+        return hashlib.sha1("\n".join(lNames).encode("utf-8")).hexdigest()
+
+    ''' Upload the files of the configured path cooperating with other workers, possibly running on other hosts,
+        which process the same directory: a file is uploaded only after claiming it, and the files whose claim
+        expired are claimed again, e.g. when the worker holding the claim crashed. Once every file has been either
+        uploaded or failed, the HTML file containing a gallery of the images uploaded by all the workers is created by
+        the first worker getting there; the others find it already containing the same images.
+    '''
+    def uploadImagesCooperativelyAndCreateHTMLGallery(self, pUploadedImagesTracker, pImageClaims, pFailedImagesJournal = None):
+        if self._nearDuplicatesMaxDistance is not None:
+            self._getLog().warning("Near duplicates are not looked for by cooperative workers, they are uploaded as well.")
+        lImages = ImageUploader.getImagesList(self._sourceImageDirectory)
+        ''' Keep going over the files as long as any of them gets claimed, since claims could expire in the meanwhile.
+            Then wait for the other workers to be done with every file, or for their claims to expire if they crashed. '''
+        while True:
+            lClaimedAny = True
+            while lClaimedAny:
+                lClaimedAny = False
+                pUploadedImagesTracker.refresh()
+                for imageFileName in lImages:
+                    if (self._isImageDone(imageFileName, pUploadedImagesTracker) or
+                        not pImageClaims.tryClaim(imageFileName)):
+                        continue
+                    lClaimedAny = True
+                    ''' Another worker could have uploaded the file right before the claim. '''
+                    pUploadedImagesTracker.refresh()
+                    if self._uploadImage(imageFileName, pUploadedImagesTracker, pFailedImagesJournal) is None:
+                        pImageClaims.releaseClaim(imageFileName)
+                    else:
+                        pImageClaims.failClaim(imageFileName)
+            pUploadedImagesTracker.refresh()
+            lPendingImages = [f for f in lImages if not (self._isImageDone(f, pUploadedImagesTracker) or pImageClaims.isClaimFailed(f))]
+            if not lPendingImages:
+                break
+            self._getLog().info("Waiting for the other workers to process {0} files...".format(len(lPendingImages)))
+            time.sleep(self._CLAIMS_POLLING_SECS)
+
+        ''' The workers getting here at the same time take turns at the gallery: the first one generates it. '''
+        while not pImageClaims.tryClaim(ImageClaims.GALLERY_CLAIM_NAME):
+            self._getLog().info("Waiting for another worker to generate the image gallery...")
+            time.sleep(self._CLAIMS_POLLING_SECS)
+        try:
+            ''' Generate the gallery unless another worker already did it with the same images. '''
+            pUploadedImagesTracker.refresh()
+            lImagesStamp = ImageUploader._getImagesStamp(pUploadedImagesTracker)
+            if pImageClaims.getGalleryStamp() != lImagesStamp:
+                self._generateHTMLFile(pUploadedImagesTracker)
+                pImageClaims.setGalleryStamp(lImagesStamp)
+        finally:
+            pImageClaims.releaseClaim(ImageClaims.GALLERY_CLAIM_NAME)
+
 
 '''=========================================================='''
 '''                   M    A    I    N                       '''
 '''=========================================================='''
 if __name__ == "__main__":
+    ''' Let the backends, which import the imguploader module, use the very classes of this script: otherwise the
+        exceptions they raise would not be instances of the exception classes caught here. '''
+    sys.modules.setdefault("imguploader", sys.modules[__name__])
     try:
         '''Parsing of the input on command line. '''
         parser = ArgumentParser()
@@ -514,17 +1490,40 @@ if __name__ == "__main__":
             action='store', dest='console_log',
             default=None,
             help='Adds a console logger for the level specified in the range 1..50')
+        parser.add_argument('-r', '--retry-failed',
+            action='store_true', dest='retry_failed',
+            default=False,
+            help='Retries only the files recorded as failed in the retry journal, once their backoff delay has elapsed')
+        parser.add_argument('-w', '--cooperative',
+            action='store_true', dest='cooperative',
+            default=False,
+            help='Splits the files with the other cooperative instances processing the same directory, even from other hosts')
         args = parser.parse_args()
+        if args.retry_failed and args.cooperative:
+            parser.error("--retry-failed cannot be used along with --cooperative")
         logLevel = getConsoleLevel(args.console_log)
 
 
         try:
             ''' Create the image uploader. '''
             imgUp = ImageUploader(os.getcwd(), logLevel)
-            ''' Launch the process acquiring exclusive access to the lock file '''
-            with UploadedImagesTracker(imgUp.getImageSourceDirectory()) as lImageTracker:
-                ''' Upload all the image files in the provided image directory and generate the HTML output image gallery.'''
-                imgUp.uploadImagesAndCreateHTMLGallery(lImageTracker)
+            ''' A cooperative instance is a worker identified by the host it runs on and by its process id. '''
+            lWorkerId = None
+            if args.cooperative:
+                lWorkerId = "{0}.{1}".format(socket.gethostname(), os.getpid())
+            ''' Launch the process acquiring exclusive (shared when cooperative) access to the lock file '''
+            with UploadedImagesTracker(imgUp.getImageSourceDirectory(), lWorkerId) as lImageTracker, \
+                FailedImagesJournal(imgUp.getImageSourceDirectory(), lWorkerId) as lFailedImagesJournal:
+                if lWorkerId is not None:
+                    ''' Upload the image files not claimed by other workers and generate the HTML output image gallery when all are done.'''
+                    imgUp.uploadImagesCooperativelyAndCreateHTMLGallery(lImageTracker,
+                        ImageClaims(imgUp.getImageSourceDirectory(), lWorkerId), lFailedImagesJournal)
+                elif args.retry_failed:
+                    ''' Retry the image files recorded in the retry journal and generate the HTML output image gallery.'''
+                    imgUp.retryFailedImagesAndCreateHTMLGallery(lImageTracker, lFailedImagesJournal)
+                else:
+                    ''' Upload all the image files in the provided image directory and generate the HTML output image gallery.'''
+                    imgUp.uploadImagesAndCreateHTMLGallery(lImageTracker, lFailedImagesJournal)
         except UploadedImagesTrackerLockAcquiringFailed as pExc:
             print("Another instance of imguploader is running: %s" % (pExc))
             
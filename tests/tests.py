@@ -12,6 +12,13 @@ import imguploader
 import traceback 
 from importlib import import_module
 from PIL import Image
+import io
+import struct
+import tempfile
+import time
+
+# The configuration file parser, saved before test_ImageUploader() replaces it with a mock.
+parseValidateConfigurationFile = imguploader.ImageUploader._parseValidateConfigurationFile
 
 # Used to mock the Image.open() behavior
 def raiseIfNotImageTypeFile(a):
@@ -20,6 +27,19 @@ def raiseIfNotImageTypeFile(a):
     if (not (a.endswith("jpg") or a.endswith("png"))):
         raise Exception()
 
+# Build a raw EXIF block with the given orientation, carrying 'thumbnail' as the IFD1 JPEG thumbnail.
+def buildExifWithThumbnail(orientation, thumbnail):
+    lIFD0 = struct.pack("<H", 1) + struct.pack("<HHLHH", 0x0112, 3, 1, orientation, 0) + struct.pack("<L", 26)
+    lIFD1 = struct.pack("<H", 2) + struct.pack("<HHLL", 0x0201, 4, 1, 56) + \
+        struct.pack("<HHLL", 0x0202, 4, 1, len(thumbnail)) + struct.pack("<L", 0)
+    return b"Exif\x00\x00" + b"II*\x00" + struct.pack("<L", 8) + lIFD0 + lIFD1 + thumbnail
+
+# Return the bytes of a JPEG image of the given size.
+def buildJpeg(size):
+    lBuffer = io.BytesIO()
+    Image.new("RGB", size).save(lBuffer, "JPEG")
+    return lBuffer.getvalue()
+
 class TestSuite_ImgUploader(unittest.TestCase):
 
     def test_getConsoleLevel(self):
@@ -117,8 +137,349 @@ class TestSuite_ImgUploader(unittest.TestCase):
                 lImgUp._backendClass.uploadImage = MagicMock(side_effect=Exception())
                 lImgTracker = MagicMock()
                 lImgTracker.isImageAlreadyUploaded.return_value = False;
+                lImgTracker.isImageSkipped.return_value = False
                 #assert not raises:
                 lImgUp.uploadImagesAndCreateHTMLGallery(lImgTracker)
             
         print("test_ImageUploader()>>")
-        
+
+    def test_EmbeddedPreview(self):
+        with patch.object(imguploader.ImageUploader, "_parseValidateConfigurationFile"):
+            lImgUp = imguploader.ImageUploader(".", 1)
+        with tempfile.TemporaryDirectory() as lTmpDir:
+            #A 3:2 image rotated by EXIF, embedding both a 3:2 and a letterboxed 4:3 thumbnail.
+            lImagePath = os.path.join(lTmpDir, "exif.jpg")
+            Image.new("RGB", (600, 400)).save(lImagePath, exif=buildExifWithThumbnail(6, buildJpeg((300, 200))))
+            lImage = Image.open(lImagePath)
+            self.assertEqual(Image.open(io.BytesIO(lImgUp._getExifThumbnailData(lImage.info["exif"]))).size, (300, 200))
+            self.assertEqual(lImgUp._findEmbeddedPreview(lImage, lImagePath, (180, 180), 6).size, (300, 200))
+            self.assertIsNone(lImgUp._findEmbeddedPreview(lImage, lImagePath, (250, 250), 6))
+            self.assertEqual(lImgUp._openOrientedImage(lImagePath, (180, 180), True).size, (200, 300))
+            self.assertEqual(lImgUp._openOrientedImage(lImagePath, (180, 180), False).size, (400, 600))
+
+            lImagePath = os.path.join(lTmpDir, "letterboxed.jpg")
+            Image.new("RGB", (600, 400)).save(lImagePath, exif=buildExifWithThumbnail(1, buildJpeg((160, 120))))
+            self.assertIsNone(lImgUp._findEmbeddedPreview(Image.open(lImagePath), lImagePath, (100, 100), 1))
+
+            #A JPEG embedding a large preview in its Multi-Picture Format index.
+            lImagePath = os.path.join(lTmpDir, "mpf.jpg")
+            Image.new("RGB", (1200, 800)).save(lImagePath, "MPO", save_all=True,
+                append_images=[Image.new("RGB", (600, 400))])
+            #The further frame of a stereo pair is not a preview, while a large thumbnail is.
+            self.assertIsNone(lImgUp._findEmbeddedPreview(Image.open(lImagePath), lImagePath, (320, 320), None))
+            lImage = Image.open(lImagePath)
+            lMPInfo = lImage._getmp()
+            lMPInfo[0xB002][1]["Attribute"]["MPType"] = "Large Thumbnail (VGA Equivalent)"
+            with patch.object(lImage, "_getmp", MagicMock(return_value=lMPInfo)):
+                self.assertEqual(lImgUp._findEmbeddedPreview(lImage, lImagePath, (320, 320), None).size, (600, 400))
+
+            #A truncated thumbnail is passed over, and the full image is used instead.
+            lBuffer = io.BytesIO()
+            Image.effect_noise((300, 200), 64).convert("RGB").save(lBuffer, "JPEG")
+            lImagePath = os.path.join(lTmpDir, "truncated.jpg")
+            Image.new("RGB", (600, 400)).save(lImagePath, exif=buildExifWithThumbnail(1, lBuffer.getvalue()[:len(lBuffer.getvalue()) // 2]))
+            self.assertIsNone(lImgUp._findEmbeddedPreview(Image.open(lImagePath), lImagePath, (180, 180), 1))
+            self.assertEqual(lImgUp._openOrientedImage(lImagePath, (180, 180), True).size, (600, 400))
+
+        self.assertIsNone(lImgUp._getExifThumbnailData(None))
+        self.assertIsNone(lImgUp._getExifThumbnailData(b"Exif\x00\x00II*\x00"))
+
+    def test_FailedImagesJournal(self):
+        with tempfile.TemporaryDirectory() as lTmpDir:
+            with patch("time.time", MagicMock(return_value=1000)):
+                with imguploader.FailedImagesJournal(lTmpDir) as lJournal:
+                    lJournal.addFailedImage("first.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+                    lJournal.addFailedImage("first.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+                    lJournal.addFailedImage("second.jpg", imguploader.FailedImagesJournal.PERMANENT_ERROR)
+                    lJournal.addFailedImage("third.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+                    lJournal.removeFailedImage("third.jpg")
+                    self.assertEqual(lJournal.getEligibleImageList(), [])
+
+            #Test the journal is persisted, and the backoff delay doubles on each failed attempt.
+            with imguploader.FailedImagesJournal(lTmpDir) as lJournal:
+                lFailedImages = {i.getImageFileName(): i for i in lJournal.getFailedImageList()}
+                self.assertEqual(sorted(lFailedImages.keys()), ["first.jpg", "second.jpg"])
+                self.assertEqual(lFailedImages["first.jpg"].getAttemptsCount(), 2)
+                self.assertEqual(lFailedImages["first.jpg"].getNextEligibleTime(), 1000 + 120)
+                self.assertEqual(lFailedImages["second.jpg"].getErrorClass(), imguploader.FailedImagesJournal.PERMANENT_ERROR)
+                with patch("time.time", MagicMock(return_value=1000 + 120)):
+                    self.assertEqual([i.getImageFileName() for i in lJournal.getEligibleImageList()], ["first.jpg"])
+
+            #Test permanent and transient failures are told apart, and an uploaded file leaves the journal.
+            with patch.object(imguploader.ImageUploader, "_parseValidateConfigurationFile"):
+                lImgUp = imguploader.ImageUploader(lTmpDir, 1)
+            lImgTracker = MagicMock()
+            lImgTracker.isImageAlreadyUploaded.return_value = False
+            lJournal = MagicMock()
+            lImgUp._remoteImageCreate = MagicMock(side_effect=imguploader.ImageUploaderPermanentException())
+            lImgUp._uploadImage("first.jpg", lImgTracker, lJournal)
+            lJournal.addFailedImage.assert_called_with("first.jpg", imguploader.FailedImagesJournal.PERMANENT_ERROR)
+            lImgUp._remoteImageCreate = MagicMock(side_effect=imguploader.ImageUploaderTransientException())
+            lImgUp._uploadImage("first.jpg", lImgTracker, lJournal)
+            lJournal.addFailedImage.assert_called_with("first.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+            lImgUp._remoteImageCreate = MagicMock(return_value="URL")
+            lImgUp._uploadImage("first.jpg", lImgTracker, lJournal)
+            lJournal.removeFailedImage.assert_called_once_with("first.jpg")
+            lImgTracker.addUploadedImage.assert_called_once_with("first.jpg", "URL", "URL", None)
+
+            #Test a crash while rewriting the journal leaves the previous content intact.
+            with imguploader.FailedImagesJournal(lTmpDir) as lJournal:
+                with patch("os.replace", MagicMock(side_effect=OSError)):
+                    self.assertRaises(OSError, lJournal.addFailedImage, "third.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+            with imguploader.FailedImagesJournal(lTmpDir) as lJournal:
+                self.assertEqual(sorted(i.getImageFileName() for i in lJournal.getFailedImageList()), ["first.jpg", "second.jpg"])
+
+            #Test a corrupted journal is detected.
+            with open(os.path.join(lTmpDir, imguploader.FailedImagesJournal._JOURNAL_FILE_NAME), "w") as lJournalFile:
+                lJournalFile.write("first.jpg<unknown<1<0\n")
+            self.assertRaises(imguploader.FailedImagesJournalException, imguploader.FailedImagesJournal, lTmpDir)
+
+    def test_CooperativeWorkers(self):
+        with tempfile.TemporaryDirectory() as lTmpDir:
+            #Test workers share the activity log lock, see each other uploads and exclude non cooperative instances.
+            with imguploader.UploadedImagesTracker(lTmpDir, "host.1") as lFirstTracker:
+                with imguploader.UploadedImagesTracker(lTmpDir, "host.2") as lSecondTracker:
+                    lFirstTracker.addUploadedImage("first.jpg", "FullURL", "ThumbURL")
+                    assert(lSecondTracker.isImageAlreadyUploaded("first.jpg") == False)
+                    lSecondTracker.refresh()
+                    assert(lSecondTracker.isImageAlreadyUploaded("first.jpg") == True)
+                    lSecondTracker.addUploadedImage("first.jpg", "FullURL", "ThumbURL")
+                    self.assertEqual(len(lSecondTracker.getImageList()), 1)
+                    self.assertRaises(imguploader.UploadedImagesTrackerLockAcquiringFailed, imguploader.UploadedImagesTracker, lTmpDir)
+                with imguploader.FailedImagesJournal(lTmpDir, "host.1") as lJournal:
+                    lJournal.addFailedImage("second.jpg", imguploader.FailedImagesJournal.TRANSIENT_ERROR)
+
+            #Test the worker files are folded by a non cooperative instance.
+            with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                self.assertEqual([i.getImageFileName() for i in lTracker.getImageList()], ["first.jpg"])
+            with imguploader.FailedImagesJournal(lTmpDir) as lJournal:
+                self.assertEqual([i.getImageFileName() for i in lJournal.getFailedImageList()], ["second.jpg"])
+            self.assertEqual(sorted(f for f in os.listdir(lTmpDir) if f.startswith(".imguploader")),
+                [".imguploader_activity_log_file", ".imguploader_retry_journal"])
+
+            #Test the unfinished last line of a crashed worker is dropped, both when folding and when its worker id is reused.
+            with tempfile.TemporaryDirectory() as lOtherTmpDir:
+                lWorkerLogPath = os.path.join(lOtherTmpDir, ".imguploader_activity_log_file.host.3")
+                with open(lWorkerLogPath, "w") as lFile:
+                    lFile.write("x.jpg<U<T\ny.jpg<U")
+                with imguploader.UploadedImagesTracker(lOtherTmpDir, "host.3") as lFirstTracker:
+                    lFirstTracker.addUploadedImage("z.jpg", "FullURL", "ThumbURL")
+                    with imguploader.UploadedImagesTracker(lOtherTmpDir, "host.4") as lSecondTracker:
+                        self.assertEqual([i.getImageFileName() for i in lSecondTracker.getImageList()], ["x.jpg", "z.jpg"])
+                with open(lWorkerLogPath, "w") as lFile:
+                    lFile.write("x.jpg<U<T\ny.jpg<U")
+                with imguploader.UploadedImagesTracker(lOtherTmpDir) as lTracker:
+                    self.assertEqual([i.getImageFileName() for i in lTracker.getImageList()], ["x.jpg"])
+                #Test a corrupted line of a worker is reported along with the name of its activity log file.
+                with open(lWorkerLogPath, "w") as lFile:
+                    lFile.write("y.jpg<U\nx.jpg<U<T\n")
+                with self.assertRaisesRegex(imguploader.UploadedImagesTrackerException, r"\.imguploader_activity_log_file\.host\.3"):
+                    imguploader.UploadedImagesTracker(lOtherTmpDir)
+
+            #Test claims exclude other workers until they expire, and failed claims are told apart from active ones.
+            lFirstClaims = imguploader.ImageClaims(lTmpDir, "host.1")
+            lSecondClaims = imguploader.ImageClaims(lTmpDir, "host.2")
+            assert(lFirstClaims.tryClaim("third.jpg") == True)
+            assert(lSecondClaims.tryClaim("third.jpg") == False)
+            assert(lSecondClaims.isClaimFailed("third.jpg") == False)
+            with patch("time.time", MagicMock(return_value=time.time() + imguploader.ImageClaims._CLAIM_LEASE_SECS + 1)):
+                assert(lSecondClaims.tryClaim("third.jpg") == True)
+            lSecondClaims.failClaim("third.jpg")
+            assert(lFirstClaims.isClaimFailed("third.jpg") == True)
+            assert(lFirstClaims.tryClaim("third.jpg") == False)
+            lSecondClaims.releaseClaim("third.jpg")
+
+            #Test the claim of a crashed worker is waited for until it expires, then the image is uploaded and the gallery generated once.
+            with patch.object(imguploader.ImageUploader, "_parseValidateConfigurationFile"):
+                lImgUp = imguploader.ImageUploader(lTmpDir, 1)
+            lImgUp._remoteImageCreate = MagicMock(return_value="URL")
+            lImgUp._generateHTMLFile = MagicMock()
+            lClock = [time.time()]
+            def advanceClock(pSecs):
+                lClock[0] += pSecs
+            assert(lSecondClaims.tryClaim("fourth.jpg") == True)
+            with patch("time.time", lambda: lClock[0]), patch("time.sleep", MagicMock(side_effect=advanceClock)) as lSleepMock:
+                with patch.object(imguploader.ImageUploader, "getImagesList", MagicMock(return_value=["third.jpg", "fourth.jpg"])):
+                    with imguploader.UploadedImagesTracker(lTmpDir, "host.1") as lTracker:
+                        lImgUp.uploadImagesCooperativelyAndCreateHTMLGallery(lTracker, lFirstClaims)
+                        self.assertEqual([i.getImageFileName() for i in lTracker.getImageList()], ["first.jpg", "third.jpg", "fourth.jpg"])
+                        assert(lSleepMock.call_count * imguploader.ImageUploader._CLAIMS_POLLING_SECS >= imguploader.ImageClaims._CLAIM_LEASE_SECS)
+                        lImgUp._generateHTMLFile.assert_called_once_with(lTracker)
+                        lImgUp.uploadImagesCooperativelyAndCreateHTMLGallery(lTracker, lFirstClaims)
+                        lImgUp._generateHTMLFile.assert_called_once_with(lTracker)
+
+                #Test a worker waits for the gallery claim held by another one, then generates the gallery again with its own uploads.
+                assert(lSecondClaims.tryClaim(imguploader.ImageClaims.GALLERY_CLAIM_NAME) == True)
+                lSleepMock.reset_mock()
+                lSleepMock.side_effect = lambda pSecs: lSecondClaims.releaseClaim(imguploader.ImageClaims.GALLERY_CLAIM_NAME)
+                with patch.object(imguploader.ImageUploader, "getImagesList", MagicMock(return_value=["third.jpg", "fourth.jpg", "fifth.jpg"])):
+                    with imguploader.UploadedImagesTracker(lTmpDir, "host.1") as lTracker:
+                        lImgUp.uploadImagesCooperativelyAndCreateHTMLGallery(lTracker, lFirstClaims)
+                        lSleepMock.assert_called_once_with(imguploader.ImageUploader._CLAIMS_POLLING_SECS)
+                        self.assertEqual(lImgUp._generateHTMLFile.call_count, 2)
+                        self.assertEqual(len(lTracker.getImageList()), 4)
+
+                #Test the gallery waits for the images another worker is processing, even when that worker holds no claim
+                # at the moment, while the images failed recently do not keep it from being generated.
+                assert(lSecondClaims.tryClaim("sixth.jpg") == True)
+                assert(lSecondClaims.tryClaim("seventh.jpg") == True)
+                lSecondClaims.failClaim("seventh.jpg")
+                def secondWorkerUploads(pSecs):
+                    with imguploader.UploadedImagesTracker(lTmpDir, "host.2") as lSecondTracker:
+                        lSecondTracker.addUploadedImage("sixth.jpg", "FullURL", "ThumbURL")
+                    lSecondClaims.releaseClaim("sixth.jpg")
+                lSleepMock.reset_mock()
+                lSleepMock.side_effect = secondWorkerUploads
+                with patch.object(imguploader.ImageUploader, "getImagesList", MagicMock(return_value=["fifth.jpg", "sixth.jpg", "seventh.jpg"])):
+                    with imguploader.UploadedImagesTracker(lTmpDir, "host.1") as lTracker:
+                        lImgUp.uploadImagesCooperativelyAndCreateHTMLGallery(lTracker, lFirstClaims)
+                        lSleepMock.assert_called_once_with(imguploader.ImageUploader._CLAIMS_POLLING_SECS)
+                        self.assertEqual(lImgUp._generateHTMLFile.call_count, 3)
+                        self.assertEqual(len(lTracker.getImageList()), 5)
+                        assert(lTracker.isImageAlreadyUploaded("seventh.jpg") == False)
+
+    def test_NearDuplicates(self):
+        import numpy
+        lRandom = numpy.random.RandomState(0)
+        lFirstPattern = lRandom.randint(0, 256, (12, 16, 3)).astype(numpy.uint8)
+        lSecondPattern = lRandom.randint(0, 256, (12, 16, 3)).astype(numpy.uint8)
+        with tempfile.TemporaryDirectory() as lTmpDir:
+            #Two shots of a burst, slightly different from each other, and an unrelated shot.
+            lShots = {"burst_1.jpg": lFirstPattern, "burst_2.jpg": numpy.clip(lFirstPattern.astype(int) + 6, 0, 255).astype(numpy.uint8),
+                "other.jpg": lSecondPattern}
+            for lFileName, lPattern in lShots.items():
+                Image.fromarray(lPattern).resize((480, 360), Image.BILINEAR).save(os.path.join(lTmpDir, lFileName), quality=90)
+            lPaths = [os.path.join(lTmpDir, f) for f in ["burst_1.jpg", "burst_2.jpg", "not_an_image.jpg", "other.jpg"]]
+            with open(lPaths[2], "w") as lFile:
+                lFile.write("text")
+
+            for lAlgorithm in (imguploader.NearDuplicatesFinder.DHASH, imguploader.NearDuplicatesFinder.PHASH):
+                lFinder = imguploader.NearDuplicatesFinder(lAlgorithm, 10)
+                lHashes, lHashedIndices = lFinder.computeHashes(lPaths)
+                self.assertEqual(lHashes.shape, (3, 8))
+                self.assertEqual(lHashedIndices, [0, 1, 3])
+                self.assertEqual(lFinder.findNearDuplicates(lPaths), [[0, 1], [2], [3]])
+                self.assertEqual(imguploader.NearDuplicatesFinder(lAlgorithm, 0).groupHashes(lHashes[[0, 0, 2]]), [[0, 1], [2]])
+                self.assertEqual(lFinder.parseHash(lFinder.formatHash(lHashes[0])).tolist(), lHashes[0].tolist())
+                self.assertEqual([lFinder.parseHash(h) for h in ["dHash:00", "pHash:00", "none", lAlgorithm + ":zz"]], [None] * 4)
+                #Test only the images whose hash is not known are hashed.
+                lKnownHashes = {0: lFinder.formatHash(lHashes[0])}
+                with patch.object(lFinder, "computeHashes", wraps=lFinder.computeHashes) as lComputeHashesMock:
+                    self.assertEqual(lFinder.findNearDuplicates(lPaths, lKnownHashes), [[0, 1], [2], [3]])
+                    lComputeHashesMock.assert_called_once_with(lPaths[1:])
+                self.assertEqual(sorted(lKnownHashes), [0, 1, 3])
+
+            #Test only the first shot of the burst is uploaded, and the other one is recorded as skipped.
+            with patch.object(imguploader.ImageUploader, "_parseValidateConfigurationFile"):
+                lImgUp = imguploader.ImageUploader(lTmpDir, 1)
+            lImgUp._nearDuplicatesMaxDistance = 10
+            lImgUp._remoteImageCreate = MagicMock(return_value="URL")
+            lImgUp._generateHTMLFile = MagicMock()
+            with patch.object(imguploader.ImageUploader, "getImagesList", MagicMock(return_value=list(lShots.keys()))):
+                with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                    lImgUp.uploadImagesAndCreateHTMLGallery(lTracker)
+                with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                    self.assertEqual(sorted(i.getImageFileName() for i in lTracker.getImageList()), ["burst_1.jpg", "other.jpg"])
+                    assert(lTracker.isImageSkipped("burst_2.jpg") == True)
+                    self.assertEqual(lTracker.getSkippedImageList()[0].getRepresentativeFileName(), "burst_1.jpg")
+                    #An uploaded image supersedes the same image skipped earlier.
+                    lTracker.addUploadedImage("burst_2.jpg", "FullURL", "ThumbURL")
+                    assert(lTracker.isImageSkipped("burst_2.jpg") == False)
+                    #The hashes of the uploaded images are noted in the activity log file.
+                    assert(lTracker.getUploadedImage("burst_1.jpg").getPerceptualHash().startswith("dHash:"))
+                    assert(lTracker.getUploadedImage("burst_2.jpg").getPerceptualHash() is None)
+
+                #Test nothing is hashed when there is nothing new to upload.
+                with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                    with patch.object(imguploader.NearDuplicatesFinder, "computeHashes") as lComputeHashesMock:
+                        lImgUp.uploadImagesAndCreateHTMLGallery(lTracker)
+                        lComputeHashesMock.assert_not_called()
+
+                #Test a later shot of the burst is skipped as near duplicate of the images uploaded by an earlier run.
+                Image.fromarray(numpy.clip(lFirstPattern.astype(int) + 3, 0, 255).astype(numpy.uint8)).resize((480, 360), Image.BILINEAR).save(
+                    os.path.join(lTmpDir, "burst_3.jpg"), quality=90)
+                imguploader.ImageUploader.getImagesList.return_value = ["burst_3.jpg"] + list(lShots.keys())
+                with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                    with patch.object(imguploader.NearDuplicatesFinder, "computeHashes", autospec=True,
+                        side_effect=imguploader.NearDuplicatesFinder.computeHashes) as lComputeHashesMock:
+                        lImgUp.uploadImagesAndCreateHTMLGallery(lTracker)
+                        self.assertEqual([os.path.basename(f) for f in lComputeHashesMock.call_args[0][1]], ["burst_2.jpg", "burst_3.jpg"])
+                    self.assertEqual(lImgUp._remoteImageCreate.call_count, 4)
+                    self.assertEqual([(i.getImageFileName(), i.getRepresentativeFileName()) for i in lTracker.getSkippedImageList()], [("burst_3.jpg", "burst_1.jpg")])
+
+                    #Test skipped images are uploaded as any other image when looking for near duplicates is disabled.
+                    lImgUp._nearDuplicatesMaxDistance = None
+                    lImgUp.uploadImagesAndCreateHTMLGallery(lTracker)
+                    assert(lTracker.isImageAlreadyUploaded("burst_3.jpg") == True)
+                    lImgUp._nearDuplicatesMaxDistance = 10
+
+            #Test a transient failure of the first shot leaves the whole burst to a later run, while a permanent one does not.
+            lThirdPattern = lRandom.randint(0, 256, (12, 16, 3)).astype(numpy.uint8)
+            for lFileName, lPattern in {"new_1.jpg": lThirdPattern, "new_2.jpg": numpy.clip(lThirdPattern.astype(int) + 6, 0, 255).astype(numpy.uint8)}.items():
+                Image.fromarray(lPattern).resize((480, 360), Image.BILINEAR).save(os.path.join(lTmpDir, lFileName), quality=90)
+            with patch.object(imguploader.ImageUploader, "getImagesList", MagicMock(return_value=["new_2.jpg", "new_1.jpg"])):
+                for lException, lExpectedUploads in [(imguploader.ImageUploaderTransientException, []),
+                    (imguploader.ImageUploaderPermanentException, ["new_2.jpg"])]:
+                    def remoteImageCreate(pPath, pSize, pUseEmbeddedPreview = False):
+                        if os.path.basename(pPath) == "new_1.jpg":
+                            raise lException()
+                        return "URL"
+                    lImgUp._remoteImageCreate = MagicMock(side_effect=remoteImageCreate)
+                    with imguploader.UploadedImagesTracker(lTmpDir) as lTracker:
+                        lImgUp.uploadImagesAndCreateHTMLGallery(lTracker)
+                        self.assertEqual([i for i in ["new_1.jpg", "new_2.jpg"] if lTracker.isImageAlreadyUploaded(i)], lExpectedUploads)
+                        assert(lTracker.isImageSkipped("new_2.jpg") == False)
+
+            #Test the maximum distance must be a count of bits of a hash.
+            lConfig = "[config]\ntmpDirPath={0}\noauthClientId=id\noauthSecret=secret\nhostingServerBackendClass=Backend\n".format(lTmpDir)
+            for lMaxDistance, lValid in [("-1", False), ("0", True), ("64", True), ("65", False)]:
+                with patch.object(imguploader.ImageUploader, "_loadConfigurationFile", lambda self, pParser: pParser.read_string(
+                    lConfig + "nearDuplicatesMaxDistance=" + lMaxDistance)), patch("imguploader.import_module"):
+                    if lValid:
+                        parseValidateConfigurationFile(lImgUp)
+                        self.assertEqual(lImgUp._nearDuplicatesMaxDistance, int(lMaxDistance))
+                    else:
+                        self.assertRaises(imguploader.ImageUploaderException, parseValidateConfigurationFile, lImgUp)
+
+    def test_BackendErrorClasses(self):
+        lBackendsModule = import_module("imgbackends")
+        lBackend = lBackendsModule.ImgurBackend()
+        for lError, lExpectedException in [(imgurpython.helpers.error.ImgurClientError("Invalid image", 400), imguploader.ImageUploaderPermanentException),
+            (imgurpython.helpers.error.ImgurClientError("Too large", 413), imguploader.ImageUploaderPermanentException),
+            (imgurpython.helpers.error.ImgurClientError("Unsupported type", 415), imguploader.ImageUploaderPermanentException),
+            (imgurpython.helpers.error.ImgurClientError("Unauthorized", 401), imguploader.ImageUploaderTransientException),
+            (imgurpython.helpers.error.ImgurClientError("Forbidden", 403), imguploader.ImageUploaderTransientException),
+            (imgurpython.helpers.error.ImgurClientError("Too many requests", 429), imguploader.ImageUploaderTransientException),
+            (imgurpython.helpers.error.ImgurClientError("Unavailable", 503), imguploader.ImageUploaderTransientException),
+            (imgurpython.helpers.error.ImgurClientRateLimitError(), imguploader.ImageUploaderTransientException)]:
+            with patch.object(lBackendsModule, "ImgurClient") as lImgurClientMock:
+                lImgurClientMock.return_value.upload_from_path.side_effect = lError
+                self.assertRaises(lExpectedException, lBackend.uploadImage, "image.jpg")
+
+        #Test the error class raised by the backend is not overridden by ImageUploader.
+        with tempfile.TemporaryDirectory() as lTmpDir:
+            with patch.object(imguploader.ImageUploader, "_parseValidateConfigurationFile"):
+                lImgUp = imguploader.ImageUploader(lTmpDir, 1)
+            lImgUp._tmpDirectory = lTmpDir
+            lImagePath = os.path.join(lTmpDir, "image.jpg")
+            Image.new("RGB", (600, 400)).save(lImagePath)
+            lImgUp._backendClass = MagicMock()
+            lImgUp._backendClass.return_value.uploadImage.side_effect = imguploader.ImageUploaderPermanentException()
+            self.assertRaises(imguploader.ImageUploaderPermanentException, lImgUp._remoteImageCreate, lImagePath, (320, 320))
+            lImgUp._backendClass.return_value.uploadImage.side_effect = IOError()
+            self.assertRaises(imguploader.ImageUploaderTransientException, lImgUp._remoteImageCreate, lImagePath, (320, 320))
+
+            #Test a truncated image is a permanent failure of the upload, while failing to save the resized image is a transient one.
+            lImgUp._backendClass.return_value.uploadImage.side_effect = None
+            lImgUp._backendClass.return_value.uploadImage.return_value = "URL"
+            with patch("PIL.Image.Image.save", MagicMock(side_effect=OSError("No space left on device"))):
+                self.assertRaises(imguploader.ImageUploaderTransientException, lImgUp._remoteImageCreate, lImagePath, (320, 320))
+            lJpeg = buildJpeg((600, 400))
+            with open(lImagePath, "wb") as lFile:
+                lFile.write(lJpeg[:len(lJpeg) // 2])
+            lImgTracker = MagicMock()
+            lImgTracker.isImageAlreadyUploaded.return_value = False
+            lJournal = MagicMock()
+            self.assertEqual(lImgUp._uploadImage("image.jpg", lImgTracker, lJournal), imguploader.FailedImagesJournal.PERMANENT_ERROR)
+            lJournal.addFailedImage.assert_called_once_with("image.jpg", imguploader.FailedImagesJournal.PERMANENT_ERROR)
+            lImgTracker.addUploadedImage.assert_not_called()